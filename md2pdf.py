@@ -14,142 +14,315 @@ Usage:
     python md2pdf.py hw1.md --pygments-style vs
     python md2pdf.py hw1.md --pygments-style friendly
     python md2pdf.py hw1.md --pygments-style monokai
+    python md2pdf.py hw1.md --force   # rebuild even if unchanged
 """
 
 import sys
 import os
 import re
 import argparse
-import base64
+import hashlib
+import json
+import tempfile
 import html as html_escape
+from urllib.parse import urlsplit
+from urllib.request import url2pathname
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from io import BytesIO
-from typing import Dict, Tuple
+from typing import Dict, List, Tuple
 
 import markdown
-from weasyprint import HTML
+from weasyprint import HTML, default_url_fetcher
 
 from pygments.formatters import HtmlFormatter
+import matplotlib
 from matplotlib import mathtext
 from matplotlib.font_manager import FontProperties
 
 
 # -------------------------
-# Math rendering (LaTeX -> SVG data URI)
+# Math rendering (LaTeX -> SVG, referenced by id)
 # -------------------------
-_math_cache: Dict[Tuple[str, int], str] = {}
+# math id -> SVG bytes. Each formula is stored once; every occurrence in the
+# HTML is a short md2pdf-math:<id> reference served by _url_fetcher, so
+# WeasyPrint fetches and parses it once however often it is repeated.
+_math_cache: Dict[str, bytes] = {}
 
-def _tex_to_svg_data_uri(tex: str, fontsize: int) -> str:
-    """Render TeX (math-mode content, WITHOUT $) into an SVG data URI."""
-    key = (tex, fontsize)
-    if key in _math_cache:
-        return _math_cache[key]
+MATH_URL_SCHEME = "md2pdf-math"
 
+MATH_DPI = 200
+
+# Rendered SVGs are also persisted on disk so repeated runs skip mathtext.
+# One directory per matplotlib version and dpi: changing either starts a
+# fresh cache instead of serving SVGs rendered the old way.
+CACHE_DIR = os.path.join(
+    os.path.expanduser("~"), ".cache", "md2pdf", f"mpl-{matplotlib.__version__}-dpi{MATH_DPI}"
+)
+
+def _math_id(tex: str, fontsize: int) -> str:
+    return hashlib.sha1(f"{fontsize}:{tex}".encode("utf-8")).hexdigest()
+
+
+def _svg_cache_path(math_id: str) -> str:
+    return os.path.join(CACHE_DIR, f"{math_id}.svg")
+
+
+def _write_svg_cache(path: str, svg_bytes: bytes):
+    """Atomically store rendered SVG bytes; cache failures are never fatal."""
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+    except OSError:
+        return
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(svg_bytes)
+        os.replace(tmp_path, path)
+    except OSError:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+
+
+def _math_to_svg(tex: str, fontsize: int) -> bytes:
     buf = BytesIO()
     prop = FontProperties(size=fontsize)
 
     # matplotlib mathtext expects a math expression with $...$
-    mathtext.math_to_image(f"${tex}$", buf, format="svg", prop=prop, dpi=200)
-    svg_bytes = buf.getvalue()
-    b64 = base64.b64encode(svg_bytes).decode("ascii")
-    uri = f"data:image/svg+xml;base64,{b64}"
-    _math_cache[key] = uri
-    return uri
+    mathtext.math_to_image(f"${tex}$", buf, format="svg", prop=prop, dpi=MATH_DPI)
+    return buf.getvalue()
 
 
-# -------------------------
-# Protect fenced code blocks so math regex won't touch them
-# -------------------------
-_FENCE_RE = re.compile(r'^(\s*)(```|~~~)')
-
-def _protect_fenced_code(md_text: str):
-    """Replace fenced code blocks with placeholders to avoid math replacement inside them."""
-    lines = md_text.splitlines(keepends=True)
-    out = []
-    blocks = {}
-    in_fence = False
-    fence = None
-    buf = []
-    key = None
-    idx = 0
-
-    for line in lines:
-        if not in_fence:
-            m = _FENCE_RE.match(line)
-            if m:
-                in_fence = True
-                fence = m.group(2)  # ``` or ~~~
-                buf = [line]
-                key = f"@@FENCED_CODE_BLOCK_{idx}@@"
-                idx += 1
-            else:
-                out.append(line)
-        else:
-            buf.append(line)
-            # end fence: line starts with the same fence marker
-            if line.lstrip().startswith(fence):
-                in_fence = False
-                blocks[key] = "".join(buf)
-                out.append(key + "\n")
-                buf = []
-                fence = None
-                key = None
+def _tex_to_math_id(tex: str, fontsize: int) -> str:
+    """Render TeX (math-mode content, WITHOUT $) into _math_cache, return its id."""
+    math_id = _math_id(tex, fontsize)
+    if math_id in _math_cache:
+        return math_id
 
-    # If unclosed fence, just keep it as-is
-    if in_fence and buf:
-        out.extend(buf)
+    cache_path = _svg_cache_path(math_id)
+    try:
+        with open(cache_path, "rb") as f:
+            svg_bytes = f.read()
+    except OSError:
+        svg_bytes = _math_to_svg(tex, fontsize)
+        _write_svg_cache(cache_path, svg_bytes)
 
-    return "".join(out), blocks
+    _math_cache[math_id] = svg_bytes
+    return math_id
 
 
-def _restore_fenced_code(md_text: str, blocks: Dict[str, str]):
-    for k, v in blocks.items():
-        md_text = md_text.replace(k, v)
-    return md_text
+# Local files (images, stylesheets) served during the current build, as
+# path -> mtime; stored with the PDF so editing one invalidates it
+_fetched_files: Dict[str, float] = {}
+
+def _url_fetcher(url: str):
+    """WeasyPrint url_fetcher serving md2pdf-math:<id> from _math_cache.
+
+    Documents are converted from local files only, so http(s) resources are
+    refused rather than waited on. file: URLs are recorded in _fetched_files.
+    """
+    scheme, _, math_id = url.partition(":")
+    if scheme == MATH_URL_SCHEME and math_id in _math_cache:
+        return {"string": _math_cache[math_id], "mime_type": "image/svg+xml"}
+    if scheme in ("http", "https"):
+        raise ValueError(f"Remote resources are not fetched: {url}")
+    if scheme == "file":
+        path = url2pathname(urlsplit(url).path)
+        try:
+            _fetched_files[path] = os.path.getmtime(path)
+        except OSError:
+            pass
+    return default_url_fetcher(url)
 
 
 # -------------------------
-# Math replacement: $$...$$ and $...$
+# Math replacement: $$...$$ and $...$, skipping fenced code blocks
 # -------------------------
-BLOCK_MATH_RE = re.compile(r"\$\$(.+?)\$\$", re.DOTALL)
-# Inline math: $...$  (avoid $$...$$ already handled; avoid \$)
-INLINE_MATH_RE = re.compile(r"(?<!\\)\$(?!\$)([^\n]+?)(?<!\\)\$")
+# One pattern, one pass: fenced code blocks are matched (and later returned
+# verbatim) ahead of the math branches, so $ inside code is never touched.
+# The pass runs on the raw UTF-8 bytes: every delimiter is ASCII, and ASCII
+# bytes never occur inside a multi-byte UTF-8 sequence.
+_FENCE_MARKERS = (b"```", b"~~~")
+# Fenced code: up to a line starting with the same fence marker. One
+# alternative per marker, so each closer is a literal instead of a
+# backreference re-checked at every candidate line.
+_FENCE_PATTERN = b"|".join(
+    rb"^[ \t]*" + re.escape(marker) + rb".*?^[ \t]*" + re.escape(marker) + rb"[^\n]*"
+    for marker in _FENCE_MARKERS
+)
+
+# Display math body: never running into a fence line
+_BLOCK_BODY = rb"(?:(?!^[ \t]*(?:```|~~~)).)+?"
+
+MATH_RE = re.compile(
+    rb"(?P<fence>" + _FENCE_PATTERN + rb")"
+    rb"|\$\$(?P<block>" + _BLOCK_BODY + rb")\$\$"
+    # Inline math: $...$ (avoid $$ and \$). Written as an unrolled loop (plain
+    # runs separated by backslash escapes) so the body can never backtrack,
+    # even on documents full of unpaired $. Display math takes priority: the
+    # closer is never the opening half of a $$...$$, so "$5 ... $$x$$" leaves
+    # the $5 alone and keeps the display math whole.
+    rb"|(?<!\\)\$(?!\$)(?P<inline>[^$\n\\]*(?:\\[^\n][^$\n\\]*)*)"
+    rb"\$(?!\$" + _BLOCK_BODY + rb"\$\$)",
+    re.MULTILINE | re.DOTALL,
+)
+
+BLOCK_MATH_SIZE = 16
+INLINE_MATH_SIZE = 12
+
+def _tex(group: bytes) -> str:
+    return group.decode("utf-8").strip()
+
+
+# Start of a fence line: one search covers every marker. re.search does not
+# let ^ match mid-line at pos, so a line starting before pos is never found.
+_FENCE_LINE_RE = re.compile(
+    rb"^[ \t]*(?:" + b"|".join(re.escape(m) for m in _FENCE_MARKERS) + rb")", re.MULTILINE
+)
+
+
+def _iter_math(md_bytes: bytes):
+    """Same matches as MATH_RE.finditer, but the pattern is only tried where
+    a match can start: at a '$', or at a fence line before the next '$' (so
+    a code block hiding it is still consumed whole). Stretches of prose are
+    skipped with bytes.find instead of being stepped through by the regex.
+    """
+    pos = 0
+    dollar = -1
+    while True:
+        # Only look for the next '$' once pos has passed the last one found,
+        # so a run of code blocks before it does not rescan the gap each time
+        if dollar < pos:
+            dollar = md_bytes.find(b"$", pos)
+            if dollar < 0:
+                return
+        fence = _FENCE_LINE_RE.search(md_bytes, pos, dollar)
+        start = fence.start() if fence is not None else dollar
+        m = MATH_RE.match(md_bytes, start)
+        if m is None:
+            pos = start + 1
+            continue
+        yield m
+        pos = m.end()
+
+
+def _math_key(m) -> Tuple[str, int]:
+    """(tex, fontsize) for a display or inline MATH_RE match."""
+    if m.group("block") is not None:
+        return _tex(m.group("block")), BLOCK_MATH_SIZE
+    return _tex(m.group("inline")), INLINE_MATH_SIZE
+
+
+# Below this many uncached formulas, worker start-up costs more than it saves
+_PARALLEL_MIN = 8
+
+def _render_one(pair: Tuple[str, int]) -> Tuple[str, bytes]:
+    """Top-level (picklable) entry point for ProcessPoolExecutor workers."""
+    math_id = _tex_to_math_id(*pair)
+    return math_id, _math_cache[math_id]
+
+
+def _render_math_batch(pairs: List[Tuple[str, int]]):
+    """Render every formula up front so substitution only hits _math_cache."""
+    pending = []
+    for pair in pairs:
+        math_id = _math_id(*pair)
+        if math_id in _math_cache or os.path.exists(_svg_cache_path(math_id)):
+            _render_one(pair)
+        else:
+            pending.append(pair)
+
+    workers = min(os.cpu_count() or 1, len(pending))
+    if len(pending) < _PARALLEL_MIN or workers < 2:
+        for pair in pending:
+            _render_one(pair)
+        return
+
+    # mathtext is CPU-bound and every formula is independent
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        _math_cache.update(ex.map(_render_one, pending))
+
+
+def _render_math_in_markdown(md_bytes: bytes) -> List[bytes]:
+    """Split the markdown into literal slices and math <img> tags referencing
+    the rendered SVG; the caller joins the chunks once."""
+    if b"$" not in md_bytes:
+        return [md_bytes]
+
+    # Fenced code needs no chunk of its own: it stays inside the literal slices
+    matches = [m for m in _iter_math(md_bytes) if m.group("fence") is None]
+    keys = [_math_key(m) for m in matches]
+    _render_math_batch(list(dict.fromkeys(keys)))
+
+    chunks = []
+    pos = 0
+    for m, (tex, fontsize) in zip(matches, keys):
+        src = f"{MATH_URL_SCHEME}:{_tex_to_math_id(tex, fontsize)}"
+        alt = html_escape.escape(tex, quote=True)
+        if m.group("block") is not None:
+            html = f'\n<div class="math-block"><img class="math-display" src="{src}" alt="{alt}"></div>\n'
+        else:
+            html = f'<img class="math-inline" src="{src}" alt="{alt}">'
+        chunks.append(md_bytes[pos:m.start()])
+        chunks.append(html.encode("utf-8"))
+        pos = m.end()
+    chunks.append(md_bytes[pos:])
+    return chunks
 
-def _render_math_in_markdown(md_text: str) -> str:
-    """Replace math delimiters with <img> tags pointing to SVG."""
-    protected, blocks = _protect_fenced_code(md_text)
 
-    def repl_block(m):
-        tex = m.group(1).strip()
-        src = _tex_to_svg_data_uri(tex, fontsize=16)
-        alt = html_escape.escape(tex, quote=True)
-        return f'\n<div class="math-block"><img class="math-display" src="{src}" alt="{alt}"></div>\n'
+_MATH_IMG_RE = re.compile(
+    r'<img class="(?P<cls>math-inline|math-display)" src="' + MATH_URL_SCHEME
+    + r':(?P<id>[0-9a-f]+)" alt="(?P<alt>[^"]*)">'
+)
+_SVG_METADATA_RE = re.compile(r"\s*<metadata>.*?</metadata>", re.DOTALL)
 
-    def repl_inline(m):
-        tex = m.group(1).strip()
-        src = _tex_to_svg_data_uri(tex, fontsize=12)
-        alt = html_escape.escape(tex, quote=True)
-        return f'<img class="math-inline" src="{src}" alt="{alt}">'
+def _inline_svg(math_id: str, cls: str, alt: str) -> str:
+    """Raw <svg> markup for a rendered formula, without XML prolog or metadata.
 
-    protected = BLOCK_MATH_RE.sub(repl_block, protected)
-    protected = INLINE_MATH_RE.sub(repl_inline, protected)
+    ``alt`` is the already-escaped alt text of the <img> it replaces; it stays
+    the formula's text alternative as role="img" plus aria-label.
+    """
+    svg = _math_cache[math_id].decode("utf-8")
+    svg = svg[svg.index("<svg"):].rstrip()
+    svg = _SVG_METADATA_RE.sub("", svg, count=1)
+    return svg.replace("<svg ", f'<svg class="{cls}" role="img" aria-label="{alt}" ', 1)
 
-    return _restore_fenced_code(protected, blocks)
 
+def _inline_single_math(html_content: str) -> str:
+    """Embed formulas used once as inline <svg> (no image fetch or data-URI
+    decode); repeated ones keep their shared md2pdf-math: reference.
 
-def convert_md_to_pdf(input_file: str, output_file: str = None, pygments_style: str = "xcode"):
-    if output_file is None:
-        base_name = os.path.splitext(input_file)[0]
-        output_file = f"{base_name}.pdf"
+    Done on the HTML, after python-markdown, so SVG text is never parsed as
+    markdown.
+    """
+    counts = Counter(m.group("id") for m in _MATH_IMG_RE.finditer(html_content))
 
-    with open(input_file, "r", encoding="utf-8") as f:
-        md_content = f.read()
+    def repl(m):
+        if counts[m.group("id")] > 1:
+            return m.group(0)
+        return _inline_svg(m.group("id"), m.group("cls"), m.group("alt"))
 
-    # 1) Pre-render math into SVG <img>
-    md_content = _render_math_in_markdown(md_content)
+    return _MATH_IMG_RE.sub(repl, html_content)
 
-    # 2) Markdown -> HTML
-    html_content = markdown.markdown(
-        md_content,
+
+def _read_md(path: str) -> bytes:
+    """Raw UTF-8 markdown with newlines normalized, as text mode would do."""
+    with open(path, "rb") as f:
+        data = f.read()
+    if b"\r" in data:
+        data = data.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+    return data
+
+
+# -------------------------
+# Markdown converter / Pygments CSS, built once per style
+# -------------------------
+@lru_cache(maxsize=8)
+def _md(pygments_style: str) -> markdown.Markdown:
+    return markdown.Markdown(
         extensions=["tables", "fenced_code", "codehilite", "toc"],
         extension_configs={
             "codehilite": {
@@ -160,63 +333,84 @@ def convert_md_to_pdf(input_file: str, output_file: str = None, pygments_style:
         },
     )
 
-    # 3) Pygments CSS (critical for nice code blocks)
-    pyg_css = HtmlFormatter(style=pygments_style).get_style_defs(".codehilite")
 
-    css_style = f"""
-    @page {{
+@lru_cache(maxsize=8)
+def _pyg_css(pygments_style: str) -> str:
+    return HtmlFormatter(style=pygments_style).get_style_defs(".codehilite")
+
+
+_CLASS_ATTR_RE = re.compile(r'class="([^"]+)"')
+# Per-token rules look like ".codehilite .kn { ... } /* Keyword.Namespace */"
+_TOKEN_RULE_RE = re.compile(r"^\.codehilite \.([\w-]+) ")
+
+def _used_pyg_css(pyg_css: str, html_content: str) -> str:
+    """Drop Pygments token rules for classes that never occur in the HTML."""
+    used = {c for attr in _CLASS_ATTR_RE.findall(html_content) for c in attr.split()}
+    kept = []
+    for line in pyg_css.splitlines():
+        m = _TOKEN_RULE_RE.match(line)
+        if m is None or m.group(1) in used:
+            kept.append(line)
+    return "\n".join(kept)
+
+
+# -------------------------
+# Page CSS and HTML skeleton (static; joined once per document)
+# -------------------------
+BASE_CSS = """
+    @page {
         size: A4;
         margin: 2cm;
         
         /* Page Numbers */
-        @bottom-left {{
+        @bottom-left {
             content: counter(page) " / " counter(pages);
             font-family: -apple-system, system-ui, sans-serif;
             font-size: 9pt;
             color: #6e7781;
-        }}
-    }}
+        }
+    }
 
     /* Body typography close to VSCode/GitHub markdown */
-    body {{
+    body {
         font-family: -apple-system, BlinkMacSystemFont, "Segoe UI",
                      "Noto Sans CJK SC", "PingFang SC", "Microsoft YaHei",
                      "WenQuanYi Micro Hei", Arial, sans-serif;
         font-size: 11pt;
         line-height: 1.6;
         color: #24292f;
-    }}
+    }
 
-    h1 {{
+    h1 {
         font-size: 22pt;
         border-bottom: 2px solid #d0d7de;
         padding-bottom: 8px;
         margin-top: 28px;
-    }}
-    h2 {{
+    }
+    h2 {
         font-size: 16pt;
         border-bottom: 1px solid #d0d7de;
         padding-bottom: 4px;
         margin-top: 22px;
-    }}
-    h3 {{ font-size: 13pt; margin-top: 18px; }}
-    h4 {{ font-size: 12pt; margin-top: 14px; }}
+    }
+    h3 { font-size: 13pt; margin-top: 18px; }
+    h4 { font-size: 12pt; margin-top: 14px; }
 
     /* Inline code */
-    code {{
+    code {
         font-family: ui-monospace, SFMono-Regular, Menlo, Monaco, Consolas, "Liberation Mono", "Courier New", monospace;
         font-size: 10pt;
         background: #f6f8fa;
         border: 1px solid #d0d7de;
         border-radius: 4px;
         padding: 0.1em 0.35em;
-    }}
+    }
 
     /* Code blocks (VSCode/GitHub-like) */
-    .codehilite {{
+    .codehilite {
         margin: 14px 0;
-    }}
-    .codehilite pre {{
+    }
+    .codehilite pre {
         background: #f6f8fa;
         border: 1px solid #d0d7de;
         border-radius: 8px;
@@ -229,84 +423,164 @@ def convert_md_to_pdf(input_file: str, output_file: str = None, pygments_style:
 
         line-height: 1.45;
         font-size: 9.5pt;
-    }}
-    .codehilite pre code {{
+    }
+    .codehilite pre code {
         background: transparent;
         border: none;
         padding: 0;
         white-space: inherit;
-    }}
+    }
 
-    /* Math */
-    .math-block {{
+    /* Math: <img> and inlined <svg> get the same box, so the generic
+       img rule below never applies to only one of them */
+    .math-block {
         text-align: center;
         margin: 10px 0 14px 0;
-    }}
-    img.math-display {{
+    }
+    img.math-display, svg.math-display {
+        display: block;
+        margin: 12px auto;
         max-width: 100%;
+        width: auto;
         height: auto;
-    }}
-    img.math-inline {{
+    }
+    img.math-inline, svg.math-inline {
+        display: inline;
+        margin: 0;
+        max-width: 100%;
+        width: auto;
         height: 1.15em;
         vertical-align: -0.15em;
-    }}
+    }
 
     /* Tables */
-    table {{
+    table {
         border-collapse: collapse;
         width: 100%;
         margin: 16px 0;
-    }}
-    th, td {{
+    }
+    th, td {
         border: 1px solid #d0d7de;
         padding: 8px 10px;
         text-align: left;
-    }}
-    th {{
+    }
+    th {
         background: #f6f8fa;
         font-weight: 600;
-    }}
+    }
 
-    img {{
+    img {
         max-width: 100%;
         height: auto;
         display: block;
         margin: 12px auto;
-    }}
+    }
 
-    blockquote {{
+    blockquote {
         border-left: 4px solid #d0d7de;
         margin: 12px 0;
         padding: 8px 12px;
         background: #f6f8fa;
         color: #57606a;
-    }}
+    }
 
-    a {{ color: #0969da; text-decoration: none; }}
+    a { color: #0969da; text-decoration: none; }
 
     /* Avoid ugly breaks */
-    pre, table, blockquote {{
+    pre, table, blockquote {
         break-inside: avoid;
-    }}
+    }
 
     /* Pygments theme */
-    {pyg_css}
     """
 
-    full_html = f"""<!DOCTYPE html>
+HTML_HEAD = """<!DOCTYPE html>
 <html lang="zh-CN">
 <head>
 <meta charset="UTF-8">
-<style>{css_style}</style>
+<style>"""
+HTML_BODY_OPEN = """</style>
 </head>
 <body>
-{html_content}
+"""
+HTML_TAIL = """
 </body>
 </html>
 """
 
+
+# -------------------------
+# Whole-PDF cache: skip WeasyPrint when input and style are unchanged
+# -------------------------
+PDF_CACHE_SUFFIX = ".md2pdf.cache.json"
+# Bump when the markdown -> HTML rendering changes, so existing PDFs rebuild
+PDF_FORMAT_VERSION = "1"
+
+def _pdf_cache_key(md_bytes: bytes, pygments_style: str) -> str:
+    # NUL-delimited: only the markdown may contain one, and it comes first,
+    # so distinct inputs can never hash the same bytes
+    return hashlib.sha256(b"\0".join([
+        md_bytes, pygments_style.encode("utf-8"),
+        PDF_FORMAT_VERSION.encode("ascii"), BASE_CSS.encode("utf-8"),
+    ])).hexdigest()
+
+
+def _pdf_is_current(input_file: str, output_file: str, key: str) -> bool:
+    try:
+        with open(output_file + PDF_CACHE_SUFFIX, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+        if cache.get("key") != key:
+            return False
+        if os.path.getmtime(output_file) <= os.path.getmtime(input_file):
+            return False
+        return all(os.path.getmtime(path) == mtime for path, mtime in cache.get("files", {}).items())
+    except (OSError, ValueError, AttributeError):
+        return False
+
+
+def _write_pdf_cache(output_file: str, key: str, files: Dict[str, float]):
+    try:
+        with open(output_file + PDF_CACHE_SUFFIX, "w", encoding="utf-8") as f:
+            json.dump({"key": key, "files": files}, f)
+    except OSError:
+        pass
+
+
+def convert_md_to_pdf(input_file: str, output_file: str = None, pygments_style: str = "xcode",
+                      force: bool = False):
+    if output_file is None:
+        base_name = os.path.splitext(input_file)[0]
+        output_file = f"{base_name}.pdf"
+
+    md_bytes = _read_md(input_file)
+
+    cache_key = _pdf_cache_key(md_bytes, pygments_style)
+    if not force and _pdf_is_current(input_file, output_file, cache_key):
+        print(f"✓ PDF up to date: {output_file}")
+        return output_file
+
+    # 1) Pre-render math into SVG <img>, then decode once for python-markdown
+    md_content = b"".join(_render_math_in_markdown(md_bytes)).decode("utf-8")
+
+    # 2) Markdown -> HTML
+    html_content = _md(pygments_style).reset().convert(md_content)
+    html_content = _inline_single_math(html_content)
+
+    # 3) Pygments CSS (critical for nice code blocks)
+    pyg_css = _used_pyg_css(_pyg_css(pygments_style), html_content)
+
+    full_html = "".join([
+        HTML_HEAD, BASE_CSS, pyg_css, "\n    ",
+        HTML_BODY_OPEN, html_content, HTML_TAIL,
+    ])
+
     base_url = os.path.dirname(os.path.abspath(input_file))
-    HTML(string=full_html, base_url=base_url).write_pdf(output_file)
+    _fetched_files.clear()
+    # Fonts are subset by default; also recompress embedded raster images
+    HTML(string=full_html, base_url=base_url, url_fetcher=_url_fetcher).write_pdf(
+        output_file, optimize_images=True
+    )
+    _write_pdf_cache(output_file, cache_key, dict(_fetched_files))
 
     print(f"✓ PDF created successfully: {output_file}")
     return output_file
@@ -317,6 +591,7 @@ def main():
     parser.add_argument("input", help="Input Markdown file path")
     parser.add_argument("output", nargs="?", help="Output PDF file path (optional)")
     parser.add_argument("--pygments-style", default="xcode", help="Pygments style (e.g., xcode, vs, friendly, monokai)")
+    parser.add_argument("--force", action="store_true", help="Rebuild even if the PDF is up to date")
     args = parser.parse_args()
 
     if not os.path.exists(args.input):
@@ -324,7 +599,7 @@ def main():
         sys.exit(1)
 
     try:
-        convert_md_to_pdf(args.input, args.output, pygments_style=args.pygments_style)
+        convert_md_to_pdf(args.input, args.output, pygments_style=args.pygments_style, force=args.force)
     except Exception as e:
         print(f"Error: {e}")
         sys.exit(1)
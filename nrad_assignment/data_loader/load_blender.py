@@ -34,6 +34,34 @@ def pose_spherical(theta, phi, radius):
     return c2w
 
 
+def pose_spherical_batch(theta, phi, radius):
+    """Vectorized pose_spherical: 1-D tensors of angles (degrees) and radii -> (N, 4, 4).
+
+    All matrices are built with tensor ops on the inputs' device, so a whole
+    trajectory is one batched computation instead of N Python calls.
+    """
+    theta, phi, radius = torch.broadcast_tensors(theta, phi, radius)
+    th = theta / 180. * np.pi
+    ph = phi / 180. * np.pi
+    zero, one = torch.zeros_like(th), torch.ones_like(th)
+    mat = lambda rows: torch.stack([torch.stack(row, -1) for row in rows], -2)
+
+    trans = mat([[one, zero, zero, zero],
+                 [zero, one, zero, zero],
+                 [zero, zero, one, radius],
+                 [zero, zero, zero, one]])
+    rot_ph = mat([[one, zero, zero, zero],
+                  [zero, torch.cos(ph), -torch.sin(ph), zero],
+                  [zero, torch.sin(ph), torch.cos(ph), zero],
+                  [zero, zero, zero, one]])
+    rot_th = mat([[torch.cos(th), zero, -torch.sin(th), zero],
+                  [zero, one, zero, zero],
+                  [torch.sin(th), zero, torch.cos(th), zero],
+                  [zero, zero, zero, one]])
+    flip = torch.tensor([[-1,0,0,0],[0,0,1,0],[0,1,0,0],[0,0,0,1]], dtype=th.dtype, device=th.device)
+    return flip @ rot_th @ rot_ph @ trans
+
+
 def load_blender_data(basedir, half_res=False, testskip=1):
     splits = ['train', 'val', 'test']
     metas = {}
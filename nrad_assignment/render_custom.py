@@ -4,6 +4,7 @@ Render a custom camera trajectory using a trained NeRF model.
 Usage:
     python render_custom.py --config configs/lego.txt
 """
+import math
 import os
 import sys
 import imageio
@@ -12,7 +13,7 @@ import torch
 
 from model_helpers import *
 from data_loader.dataset import Data
-from data_loader.load_blender import pose_spherical
+from data_loader.load_blender import pose_spherical_batch
 from model import Model
 
 DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
@@ -23,34 +24,30 @@ def custom_render_poses():
     Define your custom camera trajectory here.
     Modify this function to create any camera path you want.
     
-    pose_spherical(theta, phi, radius):
+    pose_spherical_batch(theta, phi, radius), all length-N tensors:
         theta  - azimuth angle (horizontal rotation, degrees)
         phi    - elevation angle (degrees, negative = looking down)
         radius - distance from origin
     """
     N = 120
+    i = torch.arange(N, dtype=torch.float32, device=DEVICE)
 
     # === Option 1: Top-down sweep (fixed azimuth, vary elevation) ===
-    # render_poses = torch.stack([
-    #     pose_spherical(0, phi, 4.0)
-    #     for phi in np.linspace(-30, -90, N)
-    # ], 0)
+    # render_poses = pose_spherical_batch(
+    #     torch.zeros(N, device=DEVICE),
+    #     torch.linspace(-30, -90, N, device=DEVICE),
+    #     torch.full((N,), 4.0, device=DEVICE))
 
     # === Option 2: Zoom-in spiral ===
-    # render_poses = torch.stack([
-    #     pose_spherical(angle, -30.0, radius)
-    #     for angle, radius in zip(np.linspace(-180, 180, N), np.linspace(5.0, 2.5, N))
-    # ], 0)
+    # render_poses = pose_spherical_batch(
+    #     torch.linspace(-180, 180, N, device=DEVICE),
+    #     torch.full((N,), -30.0, device=DEVICE),
+    #     torch.linspace(5.0, 2.5, N, device=DEVICE))
 
     # === Option 3: Full spiral (orbit + elevation oscillation + zoom) ===
-    render_poses = torch.stack([
-        pose_spherical(
-            angle,
-            -30 + 20 * np.sin(2 * np.pi * i / N),
-            4.0 - 1.0 * np.sin(2 * np.pi * i / N)
-        )
-        for i, angle in enumerate(np.linspace(-180, 180, N + 1)[:-1])
-    ], 0)
+    angle = torch.linspace(-180, 180, N + 1, device=DEVICE)[:-1]
+    wave = torch.sin(2 * math.pi * i / N)
+    render_poses = pose_spherical_batch(angle, -30 + 20 * wave, 4.0 - 1.0 * wave)
 
     return render_poses
 
@@ -80,24 +77,31 @@ def main():
     savedir = os.path.join(basedir, expname, f'custom_render_{model.start:06d}')
     os.makedirs(savedir, exist_ok=True)
 
-    # Render
+    # Render (MLP matmuls in fp16 on GPU; autocast keeps reductions in fp32)
     model.renderer.eval()
-    rgbs, disps = model.renderer.render_path(
-        render_poses, dataset.hwf, dataset.K, model.chunk,
-        model.nerf, model.nerf_fine,
-        near=dataset.near, far=dataset.far,
-        savedir=savedir, render_factor=args.render_factor
-    )
+    with torch.autocast(device_type=DEVICE.type, dtype=torch.float16, enabled=DEVICE.type == 'cuda'):
+        rgbs, disps = model.renderer.render_path(
+            render_poses, dataset.hwf, dataset.K, model.chunk,
+            model.nerf, model.nerf_fine,
+            near=dataset.near, far=dataset.far,
+            savedir=savedir, render_factor=args.render_factor
+        )
     model.renderer.train()
 
     # Save video
     print(f'Done rendering, saving to {savedir}')
     to8b = lambda x: (255 * np.clip(x, 0, 1)).astype(np.uint8)
-    imageio.mimwrite(os.path.join(savedir, 'custom_rgb.mp4'), to8b(rgbs), fps=30, quality=8)
-    imageio.mimwrite(os.path.join(savedir, 'custom_disp.mp4'), to8b(disps / np.max(disps)), fps=30, quality=8)
+    # Stream frame by frame: converting the whole stack at once would hold a
+    # second, uint8 copy of every frame in memory
+    with imageio.get_writer(os.path.join(savedir, 'custom_rgb.mp4'), fps=30, quality=8) as writer:
+        for rgb in rgbs:
+            writer.append_data(to8b(rgb))
+    disp_max = np.max(disps)
+    with imageio.get_writer(os.path.join(savedir, 'custom_disp.mp4'), fps=30, quality=8) as writer:
+        for disp in disps:
+            writer.append_data(to8b(disp / disp_max))
     print(f'Videos saved to {savedir}/custom_rgb.mp4')
 
 
 if __name__ == '__main__':
-    torch.set_default_tensor_type('torch.cuda.FloatTensor')
     main()